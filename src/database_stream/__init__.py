@@ -4,3 +4,11 @@ from .db_stream import DatabaseStream
 from .sqlite_db_stream import SqliteDatabaseStream
 
 __all__ = ["DatabaseStream", "SqliteDatabaseStream"]
+
+# apsw is an optional dependency; expose the faster backend only when it is installed
+try:
+    from .apsw_db_stream import ApswDatabaseStream
+except ImportError:
+    pass
+else:
+    __all__.append("ApswDatabaseStream")
@@ -0,0 +1,181 @@
+import apsw
+from .db_stream import DatabaseStream
+from .sqlite_db_stream import _FILE_DB_PRAGMAS, _table_statements, _update_consumed_in_chunks
+
+class ApswDatabaseStream(DatabaseStream):
+    """
+    標準の sqlite3 モジュールの代わりに apsw を利用する DatabaseStream のサブクラス。
+    SqliteDatabaseStream と同じ SQL（_table_statements）・PRAGMA を使い、SQLite の C API により近い経路で実行する。
+    - apsw は自動コミットで動作するため、トランザクションは BEGIN/COMMIT を明示して管理する。
+    - apsw は datetime をバインドできないため、session_ts は sqlite3 の既定アダプタと同じ
+      ISO 形式 ("YYYY-MM-DD HH:MM:SS.ffffff") の文字列として保存する。
+    """
+
+    __slots__ = (
+        '_db_path', '_uncommitted', '_commit_threshold', '_in_transaction', '_conn', '_cursor',
+        '_read_conn', '_read_cursor', '_insert_sql', '_update_sql', '_select_sql',
+        '_count_sql', '_index_sql', '_wal_mode',
+    )
+
+    def __init__(self,
+                 db_path: str,
+                 table_name: str,
+                 mode: str = 'r',
+                 commit_threshold: int = 1,
+                 batch_size: int = None):
+        """
+        Args:
+            db_path (str): SQLite の .db ファイルのパス。
+            table_name (str): 使用するテーブル名。
+            mode (str): 'r'（stdin 相当）または 'w'（stdout/stderr 相当）。
+            commit_threshold (int): 書き込みモードで自動コミットするまでの未コミット行数。
+                既定の 1 では write() 毎にコミットする。2 以上にするとその間は書き込みロックを保持し続け、
+                同じ DB ファイルを使う他のストリームが待たされるため、単独で使う場合にのみ指定すること。
+            batch_size (int): 指定すると write() の文字列をバッファし、この件数ごとに一括 INSERT する。
+        """
+        self._db_path = db_path
+        self._uncommitted = 0
+        self._commit_threshold = commit_threshold
+        self._in_transaction = False
+        super().__init__(table_name, mode, batch_size=batch_size)
+
+    def _db_connect(self):
+        """
+        apsw で SQLite データベースに接続し、カーソルを用意する。
+        """
+        self._conn = apsw.Connection(self._db_path)
+        self._cursor = self._conn.cursor()
+        if self._db_path != ':memory:':
+            # apsw は複数文を反復に合わせて順に実行するため、fetchall() で最後の文まで流しきる
+            self._cursor.execute(_FILE_DB_PRAGMAS).fetchall()
+        # journal_mode=WAL は失敗しても黙って元のモードのままになるため、実際のモードを確認する
+        self._wal_mode = self._cursor.execute("PRAGMA journal_mode;").fetchall()[0][0] == 'wal'
+        (self._insert_sql, self._update_sql, self._select_sql,
+         self._count_sql, _, self._index_sql) = _table_statements(self._table_name)
+        if self.readable():
+            self._cursor.execute(self._index_sql)
+        self._read_connect()
+
+    def _read_connect(self):
+        """
+        未消費行の SELECT 専用に、読み取り専用の接続とカーソルを用意する。
+        同じ接続で SELECT 中に書き込むと読み取りトランザクションの昇格で BUSY になり得るため、
+        WAL モードの DB の読み込みモードでは SqliteDatabaseStream と同様に別接続を開く
+        （ロールバックジャーナルでは別接続の SELECT が自身の COMMIT を待たせるため、接続を共用する）。
+        """
+        if self.readable() and self._wal_mode:
+            self._read_conn = apsw.Connection(self._db_path, flags=apsw.SQLITE_OPEN_READONLY)
+            self._read_conn.cursor().execute(
+                "PRAGMA mmap_size=1073741824; "
+                "PRAGMA query_only=1;"
+            ).fetchall()
+        else:
+            self._read_conn = self._conn
+        # SELECT 用のカーソルは別に用意し、UPDATE で読み込み中の結果セットが無効化されないようにする
+        self._read_cursor = self._read_conn.cursor()
+
+    def _begin(self):
+        """
+        トランザクション外であれば BEGIN IMMEDIATE で書き込みロックを先に取得する。
+        """
+        if not self._in_transaction:
+            self._cursor.execute("BEGIN IMMEDIATE")
+            self._in_transaction = True
+
+    def _commit(self):
+        """
+        トランザクション中であれば COMMIT する。
+        """
+        if self._in_transaction:
+            self._cursor.execute("COMMIT")
+            self._in_transaction = False
+        self._uncommitted = 0
+
+    def _rollback(self):
+        """
+        トランザクション中であれば ROLLBACK し、書き込みロックを解放する。
+        """
+        if self._in_transaction:
+            self._cursor.execute("ROLLBACK")
+            self._in_transaction = False
+        self._uncommitted = 0
+
+    def _db_close(self):
+        """
+        未コミットの行をコミットしてから、接続を閉じる。
+        コミットに失敗しても接続は必ず閉じ、例外はそのまま送出する。
+        """
+        try:
+            self._commit()
+        finally:
+            if self._read_conn is not self._conn:
+                self._read_conn.close()
+            self._conn.close()
+
+    def _write_record(self, content: str):
+        """
+        INSERT クエリで content, session_ts, hostname, pid をテーブルに保存する。
+        未コミット行数が commit_threshold に達した時（既定では毎回）、または flush()/close() 時にコミットする。
+        """
+        self._begin()
+        try:
+            self._cursor.execute(self._insert_sql, (content,) + self._bind_meta)
+        except BaseException:
+            # 他に未コミット行がなければロックを解放する
+            if not self._uncommitted:
+                self._rollback()
+            raise
+        self._uncommitted += 1
+        if self._uncommitted >= self._commit_threshold:
+            self._commit()
+
+    def _write_records(self, contents: list):
+        """
+        executemany で複数の content を一括 INSERT し、1 回のコミットで確定する。
+        途中で失敗した場合はロールバックしてバッチ全体を取り消してから例外を送出する。
+        """
+        meta = self._bind_meta
+        # write() の未コミット行を巻き添えにしないよう、先に確定させてからバッチを始める
+        self._commit()
+        self._begin()
+        try:
+            self._cursor.executemany(
+                self._insert_sql,
+                [(content,) + meta for content in contents]
+            )
+        except BaseException:
+            self._rollback()
+            raise
+        self._commit()
+
+    def _flush(self):
+        """
+        閉じられていなければ未コミットの行をコミットする。
+        """
+        if not self.closed:
+            self._commit()
+
+    def _fetch_unconsumed(self):
+        """
+        session_ts が NULL の行を (id, content) のタプルとして 1 行ずつ返すカーソルを取得する。
+        未消費行数も _unconsumed_count に設定し、readlines() の事前確保に使わせる。
+        """
+        self._unconsumed_count = self._read_cursor.execute(self._count_sql).fetchall()[0][0]
+        return self._read_cursor.execute(self._select_sql)
+
+    def _mark_consumed(self, row_id: int):
+        """
+        指定された ID の行に対して、session_ts, hostname, pid を更新し、消費済みにする。
+        """
+        # 読み込み中の SELECT が残っていると自動コミットが遅延するため、明示的にコミットする
+        self._begin()
+        self._cursor.execute(self._update_sql, self._bind_meta + (row_id,))
+        self._commit()
+
+    def _mark_consumed_many(self, row_ids: list):
+        """
+        複数の ID の行を UPDATE ... WHERE id IN (...) でまとめて更新し、1 つのトランザクションで消費済みにする。
+        """
+        self._begin()
+        _update_consumed_in_chunks(self._cursor.execute, self._table_name, self._bind_meta, row_ids)
+        self._commit()
@@ -1,36 +1,77 @@
 import io
+import itertools
 import datetime
 import socket
 import os
 
-class DatabaseStream(io.TextIOBase):
+# Hostname and PID are invariant within a process, so look them up once at import time
+_CACHED_HOSTNAME = socket.gethostname()
+_CACHED_PID = os.getpid()
+
+
+def _refresh_process_info():
+    """
+    Re-read the cached hostname and PID (registered to run in a child process after fork()).
+    """
+    global _CACHED_HOSTNAME, _CACHED_PID
+    _CACHED_HOSTNAME = socket.gethostname()
+    _CACHED_PID = os.getpid()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_refresh_process_info)
+
+# Bits of DatabaseStream._state. The mode bits are exclusive, so an open read-mode stream is exactly
+# _READ_OPEN and an open write-mode stream exactly _WRITE_OPEN; the hot paths test that with one compare.
+_READABLE = 1
+_WRITABLE = 2
+_OPEN = 4
+_READ_OPEN = _READABLE | _OPEN
+_WRITE_OPEN = _WRITABLE | _OPEN
+_MODE_BITS = {'r': _READABLE, 'w': _WRITABLE}
+
+class DatabaseStream:
     """
     An abstract file-like object that reads/writes to a database table.
     Subclasses must implement the methods marked with `raise NotImplementedError`.
+
+    The class does not inherit from io.TextIOBase (it is registered as a virtual subclass instead),
+    so instances are slot-backed; subclasses should declare `__slots__` for their own attributes.
     """
 
-    def __init__(self, table_name: str, mode: str = 'r'):
+    __slots__ = (
+        '_table_name', '_session_ts', '_hostname', '_pid', '_bind_meta',
+        '_state', '_batch_size', '_write_buffer', '_row_iterator', '_unconsumed_count',
+    )
+
+    def __init__(self, table_name: str, mode: str = 'r', batch_size: int = None):
         """
         Args:
             table_name (str): The name of the database table to use.
             mode (str): 'r' for read (stdin replacement), 'w' for write (stdout/stderr replacement).
+            batch_size (int): If given, write() buffers strings and inserts them via
+                _write_records() once `batch_size` strings have accumulated (or on flush/close).
         """
         # Common session info
         self._table_name = table_name
-        self._mode = mode
         self._session_ts = datetime.datetime.now()
-        self._hostname = socket.gethostname()
-        self._pid = os.getpid()
-        self._closed = False
+        self._hostname = _CACHED_HOSTNAME
+        self._pid = _CACHED_PID
+        # Session metadata never changes, so keep it as one bind-ready tuple for the INSERT/UPDATE
+        # hot paths. session_ts is pre-formatted exactly as sqlite3's default datetime adapter would
+        # (isoformat(" ")), so no adapter runs per row and the stored text is unchanged.
+        self._bind_meta = (self._session_ts.isoformat(" "), self._hostname, self._pid)
+        self._state = _MODE_BITS.get(mode, 0) | _OPEN
+        self._batch_size = batch_size
+        self._write_buffer = []
 
         # 1) Connect to the database (subclass provides this)
         self._db_connect()
 
-        # 2) If in read mode, fetch unconsumed rows and prepare an iterator
-        if self.readable():
-            rows = self._fetch_unconsumed()
-            # Expect each row to be a dict-like object with at least 'id' and 'content'
-            self._row_iterator = iter(rows)
+        # 2) Unconsumed rows are fetched lazily on the first read (see _ensure_rows)
+        self._row_iterator = None
+        # Optional size hint set by _fetch_unconsumed (number of unconsumed rows), used by readlines()
+        self._unconsumed_count = None
 
     # ---------- Properties and status methods ----------
 
@@ -52,15 +93,63 @@ class DatabaseStream(io.TextIOBase):
     @property
     def closed(self) -> bool:
         """True if the stream has been closed."""
-        return self._closed
+        return not self._state & _OPEN
 
     def readable(self) -> bool:
         """True if opened in read mode and not closed."""
-        return (self._mode == 'r') and (not self._closed)
+        return self._state == _READ_OPEN
 
     def writable(self) -> bool:
         """True if opened in write mode and not closed."""
-        return (self._mode == 'w') and (not self._closed)
+        return self._state == _WRITE_OPEN
+
+    # io.TextIOBase attributes: there is no text encoding layer, so these are None as in the base class
+    encoding = None
+    errors = None
+    newlines = None
+
+    def seekable(self) -> bool:
+        """Database streams never support random access."""
+        return False
+
+    def isatty(self) -> bool:
+        """Database streams are never interactive."""
+        return False
+
+    def fileno(self) -> int:
+        """
+        Raises:
+            io.UnsupportedOperation: always, since there is no underlying file descriptor.
+        """
+        raise io.UnsupportedOperation("Stream has no file descriptor.")
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET):
+        """
+        Raises:
+            io.UnsupportedOperation: always, since database streams are not seekable.
+        """
+        raise io.UnsupportedOperation("Stream is not seekable.")
+
+    def tell(self):
+        """
+        Raises:
+            io.UnsupportedOperation: always, since database streams are not seekable.
+        """
+        raise io.UnsupportedOperation("Stream is not seekable.")
+
+    def truncate(self, size: int = None):
+        """
+        Raises:
+            io.UnsupportedOperation: always, since rows cannot be truncated through the stream.
+        """
+        raise io.UnsupportedOperation("Stream cannot be truncated.")
+
+    def detach(self):
+        """
+        Raises:
+            io.UnsupportedOperation: always, since there is no underlying buffer to detach.
+        """
+        raise io.UnsupportedOperation("Stream has no underlying buffer.")
 
     # ----------- Methods for write-mode (stdout/stderr) -----------
 
@@ -71,19 +160,38 @@ class DatabaseStream(io.TextIOBase):
             ValueError: if the stream is closed.
             io.UnsupportedOperation: if not opened in write mode.
         """
-        if self._closed:
-            raise ValueError("I/O operation on closed stream.")
-        if not self.writable():
-            raise io.UnsupportedOperation("Stream is not writable.")
-        self._write_record(s)
+        if self._state != _WRITE_OPEN:
+            self._raise_not_writable()
+        if self._batch_size:
+            self._write_buffer.append(s)
+            if len(self._write_buffer) >= self._batch_size:
+                self._drain_write_buffer()
+        else:
+            self._write_record(s)
+
+    def writelines(self, lines):
+        """
+        Write every string in `lines` into the database table in a single bulk insert.
+        Raises:
+            ValueError: if the stream is closed.
+            io.UnsupportedOperation: if not opened in write mode.
+        """
+        if self._state != _WRITE_OPEN:
+            self._raise_not_writable()
+        # Keep ordering: anything buffered by write() goes in first
+        self._drain_write_buffer()
+        lines = list(lines)
+        if lines:
+            self._write_records(lines)
 
     def flush(self):
         """
         Flush any buffered data to the database.
         By default, delegates to subclass (_flush). Raises ValueError if closed.
         """
-        if self._closed:
+        if not self._state & _OPEN:
             raise ValueError("I/O operation on closed stream.")
+        self._drain_write_buffer()
         self._flush()
 
     # ----------- Methods for read-mode (stdin) -----------
@@ -96,27 +204,32 @@ class DatabaseStream(io.TextIOBase):
             ValueError: if the stream is closed.
             io.UnsupportedOperation: if not opened in read mode.
         """
-        if self._closed:
-            raise ValueError("I/O operation on closed stream.")
-        if not self.readable():
-            raise io.UnsupportedOperation("Stream is not readable.")
+        if self._state != _READ_OPEN:
+            self._raise_not_readable()
 
-        result_chunks = []
+        # Accumulate into a single growable buffer instead of a list of strings plus a join-time copy
+        buf = io.StringIO()
+        consumed_ids = []
         total_chars = 0
+        # Local bindings keep attribute lookups out of the per-row loop
+        write_chunk = buf.write
+        append_id = consumed_ids.append
 
         # Iterate through unconsumed rows until size is satisfied (or all if size < 0)
-        for row in self._row_iterator:
-            row_id = row['id']
-            content = row['content']
-            # Mark this row as consumed in the database
-            self._mark_consumed(row_id)
-            result_chunks.append(content)
+        for row in self._ensure_rows():
+            row_id, content = row
+            append_id(row_id)
+            write_chunk(content)
             total_chars += len(content)
             # If size ≥ 0 and we've reached/exceeded that length, stop
             if size >= 0 and total_chars >= size:
                 break
 
-        return "".join(result_chunks)
+        # Mark all rows read by this call as consumed in one batch
+        if consumed_ids:
+            self._mark_consumed_many(consumed_ids)
+
+        return buf.getvalue()
 
     def readline(self, limit: int = -1) -> str:
         """
@@ -126,18 +239,15 @@ class DatabaseStream(io.TextIOBase):
             ValueError: if the stream is closed.
             io.UnsupportedOperation: if not opened in read mode.
         """
-        if self._closed:
-            raise ValueError("I/O operation on closed stream.")
-        if not self.readable():
-            raise io.UnsupportedOperation("Stream is not readable.")
+        if self._state != _READ_OPEN:
+            self._raise_not_readable()
 
         try:
-            row = next(self._row_iterator)
+            row = next(self._ensure_rows())
         except StopIteration:
             return ""
 
-        row_id = row['id']
-        content = row['content']
+        row_id, content = row
         # Mark as consumed
         self._mark_consumed(row_id)
 
@@ -153,30 +263,58 @@ class DatabaseStream(io.TextIOBase):
             ValueError: if the stream is closed.
             io.UnsupportedOperation: if not opened in read mode.
         """
-        if self._closed:
-            raise ValueError("I/O operation on closed stream.")
-        if not self.readable():
-            raise io.UnsupportedOperation("Stream is not readable.")
-
-        lines = []
-        total = 0
-        for row in self._row_iterator:
-            row_id = row['id']
-            content = row['content']
-            self._mark_consumed(row_id)
-            lines.append(content)
-            total += len(content)
-            if 0 <= hint <= total:
-                break
+        if self._state != _READ_OPEN:
+            self._raise_not_readable()
+
+        rows = self._ensure_rows()
+        count = self._unconsumed_count
+        if hint < 0 and count:
+            # Unbounded read with a known row count: fill preallocated lists instead of growing them
+            self._unconsumed_count = None
+            lines = [None] * count
+            consumed_ids = [None] * count
+            n = 0
+            for row_id, content in itertools.islice(rows, count):
+                consumed_ids[n] = row_id
+                lines[n] = content
+                n += 1
+            if n < count:
+                # Some rows were already consumed by earlier reads
+                del lines[n:]
+                del consumed_ids[n:]
+            else:
+                # Pick up any rows that appeared after the count was taken
+                for row_id, content in rows:
+                    consumed_ids.append(row_id)
+                    lines.append(content)
+        else:
+            lines = []
+            consumed_ids = []
+            total = 0
+            append_line = lines.append
+            append_id = consumed_ids.append
+            for row in rows:
+                row_id, content = row
+                append_id(row_id)
+                append_line(content)
+                total += len(content)
+                if 0 <= hint <= total:
+                    break
+
+        if consumed_ids:
+            self._mark_consumed_many(consumed_ids)
 
         return lines
 
     def __iter__(self):
         """
         Return an iterator over lines (rows). Enables: for line in db_stream: …
+        Raises:
+            ValueError: if the stream is closed.
+            io.UnsupportedOperation: if not opened in read mode.
         """
-        if not self.readable():
-            raise io.UnsupportedOperation("Stream is not readable.")
+        if self._state != _READ_OPEN:
+            self._raise_not_readable()
         return self
 
     def __next__(self) -> str:
@@ -186,18 +324,15 @@ class DatabaseStream(io.TextIOBase):
             ValueError: if the stream is closed.
             io.UnsupportedOperation: if not opened in read mode.
         """
-        if self._closed:
-            raise ValueError("I/O operation on closed stream.")
-        if not self.readable():
-            raise io.UnsupportedOperation("Stream is not readable.")
+        if self._state != _READ_OPEN:
+            self._raise_not_readable()
 
         try:
-            row = next(self._row_iterator)
+            row = next(self._ensure_rows())
         except StopIteration:
             raise StopIteration
 
-        row_id = row['id']
-        content = row['content']
+        row_id, content = row
         self._mark_consumed(row_id)
         return content
 
@@ -208,17 +343,21 @@ class DatabaseStream(io.TextIOBase):
         Close the stream and release any resources (cursor, connection) cleanly.
         After this call, any further read/write raises ValueError.
         """
-        if self._closed:
+        if not self._state & _OPEN:
             return
-        self._closed = True
-        # Delegate to subclass to close DB resources
-        self._db_close()
+        try:
+            self._drain_write_buffer()
+        finally:
+            # Even if the buffered rows cannot be written, the stream is closed (as io.IOBase.close does)
+            self._state &= ~_OPEN
+            # Delegate to subclass to close DB resources
+            self._db_close()
 
     def __enter__(self):
         """
         Support for `with DatabaseStream(...) as ds: ...`.
         """
-        if self._closed:
+        if not self._state & _OPEN:
             raise ValueError("I/O operation on closed stream.")
         return self
 
@@ -229,6 +368,50 @@ class DatabaseStream(io.TextIOBase):
         self.close()
         return False  # Propagate exceptions if any
 
+    def __del__(self):
+        """
+        Close the stream on garbage collection (as io.IOBase does), so buffered rows are committed.
+        """
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def _raise_not_readable(self):
+        """
+        Slow path of the read-mode check: raise the error matching the current state.
+        """
+        if not self._state & _OPEN:
+            raise ValueError("I/O operation on closed stream.")
+        raise io.UnsupportedOperation("Stream is not readable.")
+
+    def _raise_not_writable(self):
+        """
+        Slow path of the write-mode check: raise the error matching the current state.
+        """
+        if not self._state & _OPEN:
+            raise ValueError("I/O operation on closed stream.")
+        raise io.UnsupportedOperation("Stream is not writable.")
+
+    def _ensure_rows(self):
+        """
+        Return the iterator over unconsumed rows, running _fetch_unconsumed() on first use.
+        A read-mode stream that is closed without reading therefore issues no SELECT.
+        """
+        if self._row_iterator is None:
+            # Expect each row to be an (id, content) tuple
+            self._row_iterator = iter(self._fetch_unconsumed())
+        return self._row_iterator
+
+    def _drain_write_buffer(self):
+        """
+        Insert any strings buffered by write() (batch_size mode) via _write_records().
+        """
+        if self._write_buffer:
+            buffered = self._write_buffer
+            self._write_buffer = []
+            self._write_records(buffered)
+
     # ----------- Abstract methods to be implemented by subclasses -----------
 
     def _db_connect(self):
@@ -252,10 +435,20 @@ class DatabaseStream(io.TextIOBase):
         """
         raise NotImplementedError("Subclass must implement _write_record()")
 
-    def _fetch_unconsumed(self) -> list:
+    def _write_records(self, contents: list):
+        """
+        Insert several records at once, each with session_ts, hostname, and pid.
+        Subclass may override; base implementation calls _write_record() per string.
+        """
+        for content in contents:
+            self._write_record(content)
+
+    def _fetch_unconsumed(self):
         """
         Fetch all rows that are unconsumed (e.g., session_ts IS NULL if using that convention).
-        Return a list of row-objects (e.g., dict-like) containing at least 'id' and 'content'.
+        Return an iterable (a list, or a lazily evaluated cursor) of rows, each of which must be
+        an (id, content) tuple in that order.
+        May set self._unconsumed_count to the number of rows as a preallocation hint for readlines().
         Subclass must implement.
         """
         raise NotImplementedError("Subclass must implement _fetch_unconsumed()")
@@ -267,8 +460,20 @@ class DatabaseStream(io.TextIOBase):
         """
         raise NotImplementedError("Subclass must implement _mark_consumed()")
 
+    def _mark_consumed_many(self, row_ids: list):
+        """
+        Mark several rows (by id) as consumed in one batch.
+        Subclass may override; base implementation calls _mark_consumed() per row.
+        """
+        for row_id in row_ids:
+            self._mark_consumed(row_id)
+
     def _flush(self):
         """
         Flush any buffered writes. Subclass should override if needed (e.g., commit).
         """
         pass
+
+
+# Keep isinstance(stream, io.TextIOBase) / io.IOBase checks working without the real base class
+io.TextIOBase.register(DatabaseStream)
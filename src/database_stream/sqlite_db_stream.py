@@ -1,6 +1,122 @@
+import pathlib
+import queue
 import sqlite3
+import threading
 from .db_stream import DatabaseStream
 
+# ファイル DB の接続時に適用する PRAGMA。
+# WAL + synchronous=NORMAL にして、コミット毎の fsync とジャーナル再作成を避ける
+_FILE_DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL; "
+    "PRAGMA synchronous=NORMAL; "
+    "PRAGMA temp_store=MEMORY; "
+    "PRAGMA mmap_size=268435456; "
+    "PRAGMA cache_size=-65536; "
+    "PRAGMA busy_timeout=3000;"
+)
+
+# UPDATE ... WHERE id IN (...) 1 文あたりの ID 数の上限
+# (SQLite 既定の SQLITE_MAX_VARIABLE_NUMBER=999 から固定パラメータ 3 つ分の余裕を見た値)
+_MAX_IN_PARAMS = 900
+
+
+def _table_statements(table_name):
+    """
+    テーブル名から、各バックエンドで共通に使う SQL 文を組み立てる。
+    RETURN:
+        (insert_sql, update_sql, select_sql, count_sql, consume_sql, index_sql) のタプル。
+    """
+    insert_sql = (
+        f"INSERT INTO {table_name} "
+        "(content, session_ts, hostname, pid) "
+        "VALUES (?, ?, ?, ?)"
+    )
+    update_sql = (
+        f"UPDATE {table_name} "
+        "SET session_ts = ?, hostname = ?, pid = ? "
+        "WHERE id = ?"
+    )
+    select_sql = (
+        f"SELECT id, content FROM {table_name} "
+        "WHERE session_ts IS NULL "
+        "ORDER BY id"
+    )
+    count_sql = (
+        f"SELECT COUNT(*) FROM {table_name} "
+        "WHERE session_ts IS NULL"
+    )
+    consume_sql = (
+        f"UPDATE {table_name} "
+        "SET session_ts = ?, hostname = ?, pid = ? "
+        f"WHERE id IN (SELECT id FROM {table_name} "
+        "WHERE session_ts IS NULL ORDER BY id LIMIT ?) "
+        "RETURNING id, content"
+    )
+    # 未消費行だけを対象とする部分インデックス。消費済みになった行は自動的に外れる
+    index_sql = (
+        f"CREATE INDEX IF NOT EXISTS idx_{table_name}_unconsumed "
+        f"ON {table_name}(id) WHERE session_ts IS NULL"
+    )
+    return insert_sql, update_sql, select_sql, count_sql, consume_sql, index_sql
+
+
+def _update_consumed_in_chunks(execute, table_name, meta, row_ids):
+    """
+    row_ids の行を UPDATE ... WHERE id IN (...) で消費済みにする（コミットは呼び出し側で行う）。
+    プレースホルダ数が SQLITE_MAX_VARIABLE_NUMBER を超えないよう、ID は _MAX_IN_PARAMS 件ずつに分割する。
+    Args:
+        execute: SQL と引数を受け取るカーソルの execute メソッド。
+    """
+    for start in range(0, len(row_ids), _MAX_IN_PARAMS):
+        chunk = row_ids[start:start + _MAX_IN_PARAMS]
+        placeholders = ",".join("?" * len(chunk))
+        execute(
+            f"UPDATE {table_name} "
+            "SET session_ts = ?, hostname = ?, pid = ? "
+            f"WHERE id IN ({placeholders})",
+            meta + tuple(chunk)
+        )
+
+# 非同期 UPDATE ワーカーに終了を伝える番兵
+_STOP_MARKING = object()
+
+
+def _mark_consumed_worker(db_path, update_sql, meta, mark_queue, errors):
+    """
+    async_mark=True のときに別スレッドで動くワーカー。
+    キューから取り出した行 ID をまとめて executemany で UPDATE し、バッチ毎に 1 回コミットする。
+    SQLite の接続はスレッド間で共有できないため、同じ DB に自前の接続を開く。
+    接続の準備を含めエラーは errors に記録し、呼び出し側が put() で詰まらないよう番兵まで読み捨てを続ける。
+    """
+    conn = None
+    try:
+        try:
+            conn = sqlite3.connect(db_path)
+            conn.execute("PRAGMA busy_timeout=3000;")
+        except Exception as e:
+            errors.append(e)
+        stopping = False
+        while not stopping:
+            batch = [mark_queue.get()]
+            # 溜まっている分はブロックせずに一緒に処理する
+            while True:
+                try:
+                    batch.append(mark_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is _STOP_MARKING:
+                batch.pop()
+                stopping = True
+            if batch and not errors:
+                try:
+                    conn.executemany(update_sql, [meta + (row_id,) for row_id in batch])
+                    conn.commit()
+                except Exception as e:
+                    errors.append(e)
+    finally:
+        if conn is not None:
+            conn.close()
+
 class SqliteDatabaseStream(DatabaseStream):
     """
     SQLite のみを利用する DatabaseStream のサブクラス。
@@ -10,95 +126,287 @@ class SqliteDatabaseStream(DatabaseStream):
       読んだ行を消費済みとして UPDATE する。
     """
 
+    __slots__ = (
+        '_db_path', '_uncommitted', '_commit_threshold', '_conn', '_cursor',
+        '_read_conn', '_read_cursor', '_insert_sql', '_update_sql', '_select_sql',
+        '_async_mark', '_mark_queue', '_mark_thread', '_mark_errors',
+        '_consume_chunk_size', '_consume_sql', '_count_sql', '_index_sql',
+        '_conn_closed', '_cursor_closed', '_read_conn_closed', '_read_cursor_closed',
+        '_wal_mode',
+    )
+
+    # UPDATE ... RETURNING が使える最小の SQLite バージョン
+    _RETURNING_MIN_VERSION = (3, 35, 0)
+
     def __init__(self,
                  db_path: str,
                  table_name: str,
-                 mode: str = 'r'):
+                 mode: str = 'r',
+                 commit_threshold: int = 1,
+                 batch_size: int = None,
+                 async_mark: bool = False,
+                 consume_chunk_size: int = None):
         """
         Args:
             db_path (str): SQLite の .db ファイルのパス。
             table_name (str): 使用するテーブル名。
             mode (str): 'r'（stdin 相当）または 'w'（stdout/stderr 相当）。
+            commit_threshold (int): 書き込みモードで自動コミットするまでの未コミット行数。
+                既定の 1 では write() 毎にコミットする。2 以上にするとまとめてコミットするが、
+                その間は書き込みロックを保持し続けるため、同じ DB ファイルを使う他のストリーム
+                （別テーブルの書き込みや読み込み）は閾値到達・flush()・close() まで待たされ、
+                行も他の接続からは見えない。1 つの DB を単独で使う場合にのみ指定すること。
+            batch_size (int): 指定すると write() の文字列をバッファし、この件数ごとに executemany で一括 INSERT する。
+            async_mark (bool): True にすると読み込みモードの消費済み UPDATE を別スレッドでまとめて実行する。
+                読み込みの待ち時間は短くなるが、UPDATE の永続化は close() まで保証されない。
+                WAL モードでない場合（:memory: を含む）は別接続から書き込めないため、常に同期的に UPDATE する。
+                ワーカーで起きたエラーは以降の読み込み、または close() で送出する。
+            consume_chunk_size (int): 指定すると読み込みモードで UPDATE ... RETURNING を使い、
+                最大この件数ずつ「消費済みにしながら取得」する（SELECT と UPDATE を 1 文に統合）。
+                行はチャンク単位で取得時に消費済みになるため、読み出される前に close() した行も消費済みとなる。
+                SQLite 3.35 未満では無視され、従来の SELECT + UPDATE で動作する。
         """
         # SQLite 接続情報を先行して設定し、親クラスを初期化する
         self._db_path = db_path
-        super().__init__(table_name, mode)
+        # 未コミットの INSERT 行数と、自動コミットする閾値
+        self._uncommitted = 0
+        self._commit_threshold = commit_threshold
+        self._async_mark = async_mark
+        self._mark_thread = None
+        self._mark_errors = []
+        if sqlite3.sqlite_version_info < self._RETURNING_MIN_VERSION:
+            consume_chunk_size = None
+        self._consume_chunk_size = consume_chunk_size
+        # 開いた接続・カーソルだけを閉じるための状態フラグ（未オープンは閉じ済み扱い）
+        self._conn_closed = True
+        self._cursor_closed = True
+        self._read_conn_closed = True
+        self._read_cursor_closed = True
+        super().__init__(table_name, mode, batch_size=batch_size)
 
     def _db_connect(self):
         """
         SQLite データベースに接続し、カーソルを用意する。
         """
         # detect_types=sqlite3.PARSE_DECLTYPES により TIMESTAMP カラムを自動で Python の datetime にパース
+        # cached_statements を増やし、準備済みステートメントのキャッシュを確実にヒットさせる
         self._conn = sqlite3.connect(
             self._db_path,
-            detect_types=sqlite3.PARSE_DECLTYPES
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            cached_statements=256
         )
-        # Row ファクトリを使うことで、行は dict 風に row['id'], row['content'] で参照できる
-        self._conn.row_factory = sqlite3.Row
+        self._conn_closed = False
         self._cursor = self._conn.cursor()
+        self._cursor_closed = False
+        # ファイル DB では WAL 等の PRAGMA を適用する (:memory: では WAL が使えないため既定値のまま)
+        if self._db_path != ':memory:':
+            self._cursor.executescript(_FILE_DB_PRAGMAS)
+        # WAL を使えない VFS・ファイルシステムでは journal_mode=WAL は黙って元のモードのままになるため、
+        # 実際のモードを確認しておく（読み込み接続の分離や非同期 UPDATE は WAL でのみ安全）
+        self._wal_mode = self._cursor.execute("PRAGMA journal_mode;").fetchone()[0] == 'wal'
+        # テーブル名は構築時に固定なので、SQL 文は接続時に一度だけ組み立てておく
+        (self._insert_sql, self._update_sql, self._select_sql,
+         self._count_sql, self._consume_sql, self._index_sql) = _table_statements(self._table_name)
+        if self.readable():
+            self._ensure_schema()
+        self._read_connect()
+        if (self._async_mark and self._consume_chunk_size is None
+                and self.readable() and self._wal_mode):
+            self._start_mark_worker()
+
+    def _start_mark_worker(self):
+        """
+        消費済み UPDATE 用のキューとワーカースレッドを起動する。
+        ワーカーには self を渡さず、必要な値だけを渡して参照の循環を避ける。
+        """
+        self._mark_queue = queue.Queue(maxsize=1024)
+        self._mark_thread = threading.Thread(
+            target=_mark_consumed_worker,
+            args=(self._db_path, self._update_sql, self._bind_meta,
+                  self._mark_queue, self._mark_errors),
+            daemon=True
+        )
+        self._mark_thread.start()
+
+    def _stop_mark_worker(self):
+        """
+        ワーカースレッドに残りの UPDATE を処理させて終了を待つ。
+        ワーカーが既に終了している場合は、誰も取り出さないキューへの put() で詰まらないよう番兵を送らない。
+        """
+        if self._mark_thread.is_alive():
+            self._mark_queue.put(_STOP_MARKING)
+        self._mark_thread.join()
+        self._mark_thread = None
+
+    def _read_connect(self):
+        """
+        未消費行の SELECT 専用に、読み取り専用の接続とカーソルを用意する。
+        WAL モードの DB の読み込みモードでは mmap を大きく取った別接続を開き、UPDATE は書き込み用の接続で行う。
+        それ以外（書き込みモード、:memory:、WAL が使えない場合）では書き込み用の接続を共用する。
+        ロールバックジャーナルでは読み込み接続の SELECT が SHARED ロックを保持し、自身の COMMIT を待たせるため。
+        """
+        if self.readable() and self._wal_mode:
+            read_uri = pathlib.Path(self._db_path).resolve().as_uri() + "?mode=ro"
+            self._read_conn = sqlite3.connect(
+                read_uri,
+                uri=True,
+                detect_types=sqlite3.PARSE_DECLTYPES
+            )
+            self._read_conn_closed = False
+            self._read_conn.executescript(
+                "PRAGMA mmap_size=1073741824; "
+                "PRAGMA query_only=1;"
+            )
+        else:
+            self._read_conn = self._conn
+        # SELECT 用のカーソルは別に用意し、UPDATE で読み込み中の結果セットが無効化されないようにする
+        self._read_cursor = self._read_conn.cursor()
+        self._read_cursor_closed = False
+
+    def _ensure_schema(self):
+        """
+        未消費行のスキャン用に、session_ts IS NULL の行だけを対象とする部分インデックスを作成する。
+        消費済みになった行はインデックスから自動的に外れるため、サイズは未消費行数に比例する。
+        """
+        self._cursor.execute(self._index_sql)
+        self._conn.commit()
 
     def _db_close(self):
         """
-        カーソルと接続を閉じる。
+        未コミットの行をコミットし、非同期 UPDATE のワーカーを停止してから、カーソルと接続を閉じる。
+        ワーカー停止やコミットに失敗しても、カーソルと接続は必ず閉じてから例外を送出する。
         """
         try:
-            self._cursor.close()
-        except Exception:
-            pass
-        try:
-            self._conn.close()
-        except Exception:
-            pass
+            if self._mark_thread is not None:
+                self._stop_mark_worker()
+            if self._uncommitted:
+                self._conn.commit()
+                self._uncommitted = 0
+        finally:
+            # 開いているものだけを閉じる（書き込み用と共用の読み込み接続は _read_conn_closed が True のまま）
+            if not self._read_cursor_closed:
+                self._read_cursor.close()
+                self._read_cursor_closed = True
+            if not self._read_conn_closed:
+                self._read_conn.close()
+                self._read_conn_closed = True
+            if not self._cursor_closed:
+                self._cursor.close()
+                self._cursor_closed = True
+            if not self._conn_closed:
+                self._conn.close()
+                self._conn_closed = True
+        # 非同期 UPDATE で起きたエラーは、接続を閉じ終えてから送出する
+        if self._mark_errors:
+            raise self._mark_errors[0]
 
     def _write_record(self, content: str):
         """
         INSERT クエリで content, session_ts, hostname, pid をテーブルに保存する。
+        未コミット行数が commit_threshold に達した時（既定では毎回）、または flush()/close() 時にコミットする。
         """
-        insert_sql = (
-            f"INSERT INTO {self._table_name} "
-            "(content, session_ts, hostname, pid) "
-            "VALUES (?, ?, ?, ?)"
-        )
-        self._cursor.execute(
-            insert_sql,
-            (content, self.session_ts, self.hostname, self.pid)
-        )
-        # パフォーマンスを気にする場合は毎回コミットしない設計もあるが、ここではシンプルに即コミット
+        # コミット後最初の INSERT で書き込みロックを先に取得し、WAL 下でのロック昇格デッドロックを避ける
+        if not self._conn.in_transaction:
+            self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._cursor.execute(self._insert_sql, (content,) + self._bind_meta)
+        except BaseException:
+            # 失敗した INSERT 自体は取り消されている。他に未コミット行がなければロックを解放する
+            if not self._uncommitted:
+                self._conn.rollback()
+            raise
+        self._uncommitted += 1
+        if self._uncommitted >= self._commit_threshold:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def _write_records(self, contents: list):
+        """
+        executemany で複数の content を一括 INSERT し、1 回のコミットで確定する。
+        途中で失敗した場合はロールバックしてロックを解放し、バッチ全体を取り消してから例外を送出する。
+        """
+        meta = self._bind_meta
+        # write() の未コミット行を巻き添えにしないよう、先に確定させてからバッチを始める
+        if self._conn.in_transaction:
+            self._conn.commit()
+            self._uncommitted = 0
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._cursor.executemany(
+                self._insert_sql,
+                [(content,) + meta for content in contents]
+            )
+        except BaseException:
+            self._conn.rollback()
+            raise
         self._conn.commit()
 
     def _flush(self):
         """
         コミットを要求された場合に実行する。閉じられていなければコミットを実行。
         """
-        if not self._closed:
+        if not self.closed:
             self._conn.commit()
+            self._uncommitted = 0
 
-    def _fetch_unconsumed(self) -> list:
+    def _fetch_unconsumed(self):
         """
-        session_ts が NULL の行をすべて取得する。
+        session_ts が NULL の行を順に返すカーソルを取得する。
         RETURN:
-            List of sqlite3.Row。各 Row は 'id' と 'content' キーを持つ。
+            (id, content) のタプルを 1 行ずつ返す Cursor。
+            行ファクトリは使わず、列名での参照コストを避けてタプルのまま返す。
+        未消費行数も数えて _unconsumed_count に設定し、readlines() の事前確保に使わせる
+        （部分インデックスがあるため COUNT は未消費行数分の走査で済む）。
         """
-        select_sql = (
-            f"SELECT id, content FROM {self._table_name} "
-            "WHERE session_ts IS NULL "
-            "ORDER BY id"
-        )
-        self._cursor.execute(select_sql)
-        # fetchall() でリストとして返却。Row オブジェクトには row['id'], row['content'] がある。
-        return self._cursor.fetchall()
+        self._unconsumed_count = self._read_cursor.execute(self._count_sql).fetchone()[0]
+        if self._consume_chunk_size is not None:
+            return self._consume_chunks()
+        # fetchall() で全行を実体化せず、カーソル自体をイテレータとして返して 1 行ずつ読み出す
+        return self._read_cursor.execute(self._select_sql)
+
+    def _consume_chunks(self):
+        """
+        UPDATE ... RETURNING で未消費行を consume_chunk_size 件ずつ消費済みにしながら取得するジェネレータ。
+        RETURNING の行順は保証されないため、チャンク毎に id 順に並べ直してから返す。
+        """
+        chunk_size = self._consume_chunk_size
+        params = self._bind_meta + (chunk_size,)
+        while not self.closed:
+            rows = self._cursor.execute(self._consume_sql, params).fetchall()
+            self._conn.commit()
+            rows.sort()
+            yield from rows
+            if len(rows) < chunk_size:
+                return
 
     def _mark_consumed(self, row_id: int):
         """
         指定された ID の行に対して、session_ts, hostname, pid を更新し、消費済みにする。
+        consume_chunk_size 指定時は取得時に消費済みになっているため何もしない。
         """
-        update_sql = (
-            f"UPDATE {self._table_name} "
-            "SET session_ts = ?, hostname = ?, pid = ? "
-            "WHERE id = ?"
-        )
-        self._cursor.execute(
-            update_sql,
-            (self.session_ts, self.hostname, self.pid, row_id)
-        )
+        if self._consume_chunk_size is not None:
+            return
+        if self._mark_thread is not None:
+            # ワーカーが失敗していれば、行を黙って未消費のまま残さずにここで送出する
+            if self._mark_errors:
+                raise self._mark_errors[0]
+            self._mark_queue.put(row_id)
+            return
+        self._cursor.execute(self._update_sql, self._bind_meta + (row_id,))
+        self._conn.commit()
+
+    def _mark_consumed_many(self, row_ids: list):
+        """
+        複数の ID の行を UPDATE ... WHERE id IN (...) でまとめて更新し、1 回のコミットで消費済みにする。
+        プレースホルダ数が SQLITE_MAX_VARIABLE_NUMBER を超えないよう、ID は分割して渡す。
+        """
+        if self._consume_chunk_size is not None:
+            return
+        if self._mark_thread is not None:
+            if self._mark_errors:
+                raise self._mark_errors[0]
+            for row_id in row_ids:
+                self._mark_queue.put(row_id)
+            return
+        _update_consumed_in_chunks(self._cursor.execute, self._table_name, self._bind_meta, row_ids)
         self._conn.commit()
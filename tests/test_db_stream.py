@@ -108,3 +108,391 @@ def test_read_stdin_marks_consumed(temp_db):
         assert hostname is not None
         assert pid is not None
     conn.close()
+
+def test_connect_enables_wal(temp_db):
+    db_out = SqliteDatabaseStream(temp_db, "stdout_stream", mode='w')
+    db_out.close()
+
+    conn = sqlite3.connect(temp_db)
+    mode = conn.execute("PRAGMA journal_mode;").fetchone()[0]
+    conn.close()
+    assert mode == "wal"
+
+def test_write_batches_commits_until_close(temp_db):
+    db_out = SqliteDatabaseStream(temp_db, "stdout_stream", mode='w', commit_threshold=3)
+    db_out.write("a\n")
+    db_out.write("b\n")
+
+    conn = sqlite3.connect(temp_db)
+    count = lambda: conn.execute("SELECT COUNT(*) FROM stdout_stream;").fetchone()[0]
+    # Below the threshold nothing is visible to other connections yet
+    assert count() == 0
+    db_out.write("c\n")
+    assert count() == 3
+    db_out.write("d\n")
+    db_out.close()
+    # close() commits the remaining row
+    assert count() == 4
+    conn.close()
+
+def test_readlines_marks_all_consumed(temp_db):
+    conn = sqlite3.connect(temp_db)
+    conn.executemany("INSERT INTO stdin_stream (content) VALUES (?);",
+                     [("L%d\n" % i,) for i in range(5)])
+    conn.commit()
+    conn.close()
+
+    db_in = SqliteDatabaseStream(temp_db, "stdin_stream", mode='r')
+    assert db_in.readlines() == ["L%d\n" % i for i in range(5)]
+    db_in.close()
+
+    conn = sqlite3.connect(temp_db)
+    remaining = conn.execute("SELECT COUNT(*) FROM stdin_stream WHERE session_ts IS NULL;").fetchone()[0]
+    conn.close()
+    assert remaining == 0
+
+def test_read_mode_creates_unconsumed_index(temp_db):
+    db_in = SqliteDatabaseStream(temp_db, "stdin_stream", mode='r')
+    db_in.close()
+
+    conn = sqlite3.connect(temp_db)
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id, content FROM stdin_stream "
+        "WHERE session_ts IS NULL ORDER BY id;"
+    ).fetchall()
+    conn.close()
+    details = " ".join(row[-1] for row in plan)
+    assert "idx_stdin_stream_unconsumed" in details
+    assert "TEMP B-TREE" not in details
+
+def test_writelines_and_batch_size(temp_db):
+    db_out = SqliteDatabaseStream(temp_db, "stdout_stream", mode='w', batch_size=2)
+    db_out.write("w1\n")
+    db_out.writelines(["b1\n", "b2\n", "b3\n"])
+    db_out.write("w2\n")
+    db_out.close()
+
+    conn = sqlite3.connect(temp_db)
+    rows = [r[0] for r in conn.execute("SELECT content FROM stdout_stream ORDER BY id;")]
+    conn.close()
+    assert rows == ["w1\n", "b1\n", "b2\n", "b3\n", "w2\n"]
+
+def test_apsw_backend_round_trip(tmp_path):
+    apsw = pytest.importorskip("apsw")
+    from database_stream.apsw_db_stream import ApswDatabaseStream
+
+    # apsw bundles its own SQLite; opening the same file through the stdlib sqlite3 module in this
+    # process would break SQLite's POSIX locks, so set up and verify through apsw only
+    db_file = str(tmp_path / "test_apsw_stream.db")
+    conn = apsw.Connection(db_file)
+    conn.cursor().execute('''
+    CREATE TABLE stream (
+        id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        content     TEXT NOT NULL,
+        session_ts  TIMESTAMP,
+        hostname    TEXT,
+        pid         INTEGER
+    );
+    ''')
+
+    # Two writers open at once on the same file must not lock each other out
+    db_out = ApswDatabaseStream(db_file, "stream", mode='w')
+    db_other = ApswDatabaseStream(db_file, "stream", mode='w')
+    db_out.write("A\n")
+    db_other.write("B\n")
+    db_out.writelines(["C\n"])
+    db_other.close()
+    db_out.close()
+    # Turn the written rows back into unconsumed input
+    conn.cursor().execute("UPDATE stream SET session_ts = NULL;")
+
+    db_in = ApswDatabaseStream(db_file, "stream", mode='r')
+    assert db_in.readline() == "A\n"
+    assert db_in.read() == "B\nC\n"
+    db_in.close()
+
+    remaining = conn.cursor().execute(
+        "SELECT COUNT(*) FROM stream WHERE session_ts IS NULL;"
+    ).fetchall()[0][0]
+    conn.close()
+    assert remaining == 0
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork()")
+def test_cached_pid_refreshed_after_fork():
+    from database_stream import db_stream
+
+    read_fd, write_fd = os.pipe()
+    child = os.fork()
+    if child == 0:
+        os.close(read_fd)
+        ok = db_stream._CACHED_PID == os.getpid()
+        os.write(write_fd, b"1" if ok else b"0")
+        os._exit(0)
+    os.close(write_fd)
+    result = os.read(read_fd, 1)
+    os.close(read_fd)
+    os.waitpid(child, 0)
+    assert result == b"1"
+
+def test_stream_is_slot_backed_file_like(temp_db):
+    import io
+
+    db_out = SqliteDatabaseStream(temp_db, "stdout_stream", mode='w')
+    assert isinstance(db_out, io.TextIOBase)
+    assert not hasattr(db_out, "__dict__")
+    # The io.TextIOBase interface is still complete
+    assert db_out.encoding is None and db_out.errors is None and db_out.newlines is None
+    for call in (lambda: db_out.seek(0), db_out.tell, db_out.truncate, db_out.detach, db_out.fileno):
+        with pytest.raises(io.UnsupportedOperation):
+            call()
+    print("via print", file=db_out)
+    db_out.close()
+
+    conn = sqlite3.connect(temp_db)
+    rows = [r[0] for r in conn.execute("SELECT content FROM stdout_stream ORDER BY id;")]
+    conn.close()
+    assert "".join(rows) == "via print\n"
+
+def test_async_mark_consumed_on_close(temp_db):
+    conn = sqlite3.connect(temp_db)
+    conn.executemany("INSERT INTO stdin_stream (content) VALUES (?);",
+                     [("L%d\n" % i,) for i in range(2000)])
+    conn.commit()
+    conn.close()
+
+    db_in = SqliteDatabaseStream(temp_db, "stdin_stream", mode='r', async_mark=True)
+    assert db_in.readline() == "L0\n"
+    assert next(db_in) == "L1\n"
+    assert len(db_in.readlines()) == 1998
+    db_in.close()
+
+    conn = sqlite3.connect(temp_db)
+    remaining = conn.execute("SELECT COUNT(*) FROM stdin_stream WHERE session_ts IS NULL;").fetchone()[0]
+    conn.close()
+    assert remaining == 0
+
+@pytest.mark.skipif(sqlite3.sqlite_version_info < (3, 35, 0), reason="requires UPDATE ... RETURNING")
+def test_consume_chunks_with_update_returning(temp_db):
+    conn = sqlite3.connect(temp_db)
+    conn.executemany("INSERT INTO stdin_stream (content) VALUES (?);",
+                     [("L%d\n" % i,) for i in range(10)])
+    conn.commit()
+
+    db_in = SqliteDatabaseStream(temp_db, "stdin_stream", mode='r', consume_chunk_size=4)
+    assert db_in.readline() == "L0\n"
+    # The whole first chunk is marked consumed as soon as it is fetched
+    remaining = lambda: conn.execute(
+        "SELECT COUNT(*) FROM stdin_stream WHERE session_ts IS NULL;").fetchone()[0]
+    assert remaining() == 6
+    assert db_in.readlines() == ["L%d\n" % i for i in range(1, 10)]
+    db_in.close()
+    assert remaining() == 0
+    conn.close()
+
+def test_read_fetches_lazily(temp_db):
+    db_in = SqliteDatabaseStream(temp_db, "stdin_stream", mode='r')
+
+    # Rows inserted after construction are still seen, because nothing is selected until the first read
+    conn = sqlite3.connect(temp_db)
+    conn.execute("INSERT INTO stdin_stream (content) VALUES (?);", ("Late\n",))
+    conn.commit()
+    conn.close()
+
+    assert db_in.read() == "Late\n"
+    db_in.close()
+
+def test_mode_and_closed_errors(temp_db):
+    import io
+
+    db_in = SqliteDatabaseStream(temp_db, "stdin_stream", mode='r')
+    assert db_in.readable() and not db_in.writable()
+    with pytest.raises(io.UnsupportedOperation):
+        db_in.write("x\n")
+    db_out = SqliteDatabaseStream(temp_db, "stdout_stream", mode='w')
+    with pytest.raises(io.UnsupportedOperation):
+        iter(db_out)
+    db_out.close()
+    db_in.close()
+    assert db_in.closed and not db_in.readable()
+    with pytest.raises(ValueError):
+        db_in.readline()
+    with pytest.raises(ValueError):
+        db_in.flush()
+
+def test_session_ts_round_trips_as_timestamp(temp_db):
+    db_out = SqliteDatabaseStream(temp_db, "stdout_stream", mode='w')
+    db_out.write("x\n")
+    session_ts = db_out.session_ts
+    db_out.close()
+
+    conn = sqlite3.connect(temp_db, detect_types=sqlite3.PARSE_DECLTYPES)
+    stored = conn.execute("SELECT session_ts FROM stdout_stream;").fetchone()[0]
+    conn.close()
+    assert stored == session_ts
+
+def test_concurrent_streams_on_same_file(temp_db):
+    conn = sqlite3.connect(temp_db)
+    conn.execute("INSERT INTO stdin_stream (content) VALUES (?);", ("In\n",))
+    conn.commit()
+
+    # stdout, stderr and stdin streams share one DB file and are all open at once
+    db_out = SqliteDatabaseStream(temp_db, "stdout_stream", mode='w')
+    db_out.write("o\n")
+    db_err = SqliteDatabaseStream(temp_db, "stderr_stream", mode='w')
+    db_err.write("e\n")
+    db_in = SqliteDatabaseStream(temp_db, "stdin_stream", mode='r')
+    assert db_in.readline() == "In\n"
+    db_out.write("o2\n")
+
+    # Each write is visible to other connections right away
+    assert conn.execute("SELECT COUNT(*) FROM stdout_stream;").fetchone()[0] == 2
+    assert conn.execute("SELECT COUNT(*) FROM stderr_stream;").fetchone()[0] == 1
+    assert conn.execute("SELECT COUNT(*) FROM stdin_stream WHERE session_ts IS NULL;").fetchone()[0] == 0
+
+    db_in.close()
+    db_err.close()
+    db_out.close()
+    conn.close()
+
+def test_failed_batch_on_close_releases_lock(temp_db):
+    db_out = SqliteDatabaseStream(temp_db, "stdout_stream", mode='w', batch_size=10)
+    db_out.write("ok\n")
+    db_out.write(None)  # violates content NOT NULL when the batch is inserted
+    with pytest.raises(sqlite3.IntegrityError):
+        db_out.close()
+    assert db_out.closed
+
+    # The failed batch was rolled back, so other writers are not blocked
+    db_err = SqliteDatabaseStream(temp_db, "stderr_stream", mode='w')
+    db_err.write("e\n")
+    db_err.close()
+
+    conn = sqlite3.connect(temp_db)
+    assert conn.execute("SELECT COUNT(*) FROM stdout_stream;").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM stderr_stream;").fetchone()[0] == 1
+    conn.close()
+
+def test_close_releases_handles_when_final_commit_fails(temp_db):
+    db_out = SqliteDatabaseStream(temp_db, "stdout_stream", mode='w', commit_threshold=10)
+    db_out.write("a\n")
+
+    # Wrap the connection so that only the final commit in close() fails
+    real_conn = db_out._conn
+
+    class FailingCommit:
+        def __getattr__(self, name):
+            return getattr(real_conn, name)
+
+        def commit(self):
+            raise sqlite3.OperationalError("commit failed")
+
+    db_out._conn = FailingCommit()
+    with pytest.raises(sqlite3.OperationalError):
+        db_out.close()
+    assert db_out.closed
+    # The real connection was still closed in the finally block
+    with pytest.raises(sqlite3.ProgrammingError):
+        real_conn.execute("SELECT 1;")
+
+def test_read_marks_consumed_across_in_list_chunks(temp_db):
+    # 2000 rows cross two 900-id IN-list boundaries in _update_consumed_in_chunks
+    conn = sqlite3.connect(temp_db)
+    conn.executemany("INSERT INTO stdin_stream (content) VALUES (?);",
+                     [("L%d\n" % i,) for i in range(2000)])
+    conn.commit()
+
+    db_in = SqliteDatabaseStream(temp_db, "stdin_stream", mode='r')
+    assert db_in.read() == "".join("L%d\n" % i for i in range(2000))
+    db_in.close()
+
+    remaining = conn.execute("SELECT COUNT(*) FROM stdin_stream WHERE session_ts IS NULL;").fetchone()[0]
+    conn.close()
+    assert remaining == 0
+
+def test_read_without_wal_shares_connection(temp_db, monkeypatch):
+    from database_stream import sqlite_db_stream
+
+    # Simulate a filesystem where WAL is unavailable: the database stays in rollback-journal mode
+    monkeypatch.setattr(sqlite_db_stream, "_FILE_DB_PRAGMAS", "PRAGMA busy_timeout=3000;")
+    conn = sqlite3.connect(temp_db)
+    conn.executemany("INSERT INTO stdin_stream (content) VALUES (?);", [("A\n",), ("B\n",), ("C\n",)])
+    conn.commit()
+
+    db_in = SqliteDatabaseStream(temp_db, "stdin_stream", mode='r')
+    assert db_in._read_conn is db_in._conn
+    assert db_in.readline() == "A\n"
+    assert db_in.read() == "B\nC\n"
+    db_in.close()
+
+    remaining = conn.execute("SELECT COUNT(*) FROM stdin_stream WHERE session_ts IS NULL;").fetchone()[0]
+    conn.close()
+    assert remaining == 0
+
+def test_async_mark_worker_setup_failure_is_raised(temp_db, monkeypatch):
+    import threading
+    from database_stream import sqlite_db_stream
+
+    conn = sqlite3.connect(temp_db)
+    conn.executemany("INSERT INTO stdin_stream (content) VALUES (?);",
+                     [("L%d\n" % i,) for i in range(3000)])
+    conn.commit()
+
+    # Only the worker thread's own connect fails
+    real_connect = sqlite3.connect
+
+    def connect(*args, **kwargs):
+        if threading.current_thread() is not threading.main_thread():
+            raise sqlite3.OperationalError("worker connect failed")
+        return real_connect(*args, **kwargs)
+
+    monkeypatch.setattr(sqlite_db_stream.sqlite3, "connect", connect)
+    db_in = SqliteDatabaseStream(temp_db, "stdin_stream", mode='r', async_mark=True)
+    # More ids than the queue holds must neither block nor be dropped silently
+    with pytest.raises(sqlite3.OperationalError, match="worker connect failed"):
+        try:
+            db_in.readlines()
+        finally:
+            db_in.close()
+    assert db_in.closed
+    monkeypatch.undo()
+
+    remaining = conn.execute("SELECT COUNT(*) FROM stdin_stream WHERE session_ts IS NULL;").fetchone()[0]
+    conn.close()
+    assert remaining == 3000
+
+def _insert_stdin_lines(db_path, lines):
+    conn = sqlite3.connect(db_path)
+    conn.executemany("INSERT INTO stdin_stream (content) VALUES (?);", [(line,) for line in lines])
+    conn.commit()
+    conn.close()
+
+def _count_unconsumed_stdin(db_path):
+    conn = sqlite3.connect(db_path)
+    remaining = conn.execute("SELECT COUNT(*) FROM stdin_stream WHERE session_ts IS NULL;").fetchone()[0]
+    conn.close()
+    return remaining
+
+def test_readlines_after_readline_trims_preallocated_list(temp_db):
+    _insert_stdin_lines(temp_db, ["A\n", "B\n", "C\n", "D\n"])
+    db_in = SqliteDatabaseStream(temp_db, "stdin_stream", mode='r')
+    assert db_in.readline() == "A\n"
+    # The COUNT hint still says 4, so the preallocated lists must be trimmed to the 3 rows left
+    assert db_in.readlines() == ["B\n", "C\n", "D\n"]
+    db_in.close()
+    assert _count_unconsumed_stdin(temp_db) == 0
+
+def test_readlines_picks_up_rows_beyond_count_hint(temp_db):
+    class LateRowsStream(SqliteDatabaseStream):
+        __slots__ = ()
+
+        def _fetch_unconsumed(self):
+            rows = super()._fetch_unconsumed()
+            # As if the last two rows were inserted between the COUNT and the SELECT
+            self._unconsumed_count -= 2
+            return rows
+
+    _insert_stdin_lines(temp_db, ["A\n", "B\n", "C\n", "D\n", "E\n"])
+    db_in = LateRowsStream(temp_db, "stdin_stream", mode='r')
+    assert db_in.readlines() == ["A\n", "B\n", "C\n", "D\n", "E\n"]
+    db_in.close()
+    assert _count_unconsumed_stdin(temp_db) == 0